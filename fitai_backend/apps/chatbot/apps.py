@@ -11,8 +11,10 @@ class ChatbotConfig(AppConfig):
         """
         Configurações executadas quando a app é carregada
         """
-        # Importar signals se necessário no futuro
         try:
+            # Signals de invalidação do cache de contexto
+            from . import signals  # noqa: F401
+            
             # Registro de métricas ou outras inicializações podem ir aqui
             self._setup_logging()
         except Exception as e:
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-15 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user', 'status', '-created_at'], name='chatbot_con_user_id_810986_idx'),
+        ),
+    ]
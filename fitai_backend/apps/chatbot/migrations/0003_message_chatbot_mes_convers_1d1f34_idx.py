@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-15 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_conversation_chatbot_con_user_id_810986_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', '-created_at'], name='chatbot_mes_convers_1d1f34_idx'),
+        ),
+    ]
@@ -77,9 +77,12 @@ class Conversation(models.Model):
         self.expires_at = timezone.now() + timedelta(days=days)
         self.save(update_fields=['expires_at'])
     
-    def get_last_messages(self, limit=10):
-        """Retorna últimas mensagens para contexto"""
-        return self.messages.order_by('-created_at')[:limit]
+    def get_last_messages(self, limit=10, only_fields=('message_type', 'content', 'created_at')):
+        """Retorna últimas mensagens para contexto (mais recentes primeiro)"""
+        queryset = self.messages.order_by('-created_at')
+        if only_fields:
+            queryset = queryset.only(*only_fields)
+        return queryset[:limit]
     
     def update_activity(self):
         """Atualiza timestamp de última atividade"""
@@ -94,6 +97,9 @@ class Conversation(models.Model):
         verbose_name = "Conversa de Chat"
         verbose_name_plural = "Conversas de Chat"
         ordering = ['-last_activity_at']
+        indexes = [
+            models.Index(fields=['user', 'status', '-created_at']),
+        ]
 
 
 class Message(models.Model):
@@ -196,6 +202,9 @@ class Message(models.Model):
         verbose_name = "Mensagem"
         verbose_name_plural = "Mensagens"
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['conversation', '-created_at']),
+        ]
 
 
 class ChatContext(models.Model):
@@ -248,10 +257,34 @@ class ChatContext(models.Model):
             context.context_value = value
             context.relevance_score = relevance
             context.updated_at = timezone.now()
-            context.save()
+            context.save(update_fields=['context_value', 'relevance_score', 'updated_at'])
         
         return context
     
+    @classmethod
+    def bulk_set_contexts(cls, conversation, entries):
+        """
+        Define vários contextos em uma única query (INSERT ... ON CONFLICT DO UPDATE)
+        entries: lista de tuplas (context_type, key, value, relevance)
+        """
+        contexts = [
+            cls(
+                conversation=conversation,
+                context_type=context_type,
+                context_key=key,
+                context_value=value,
+                relevance_score=relevance
+            )
+            for context_type, key, value, relevance in entries
+        ]
+    
+        return cls.objects.bulk_create(
+            contexts,
+            update_conflicts=True,
+            unique_fields=['conversation', 'context_type', 'context_key'],
+            update_fields=['context_value', 'relevance_score', 'updated_at']
+        )
+    
     @classmethod
     def get_context(cls, conversation, context_type=None, key=None):
         """Recupera contexto específico"""
@@ -269,6 +302,16 @@ class ChatContext(models.Model):
         
         return queryset.order_by('-relevance_score', '-updated_at')
     
+    @classmethod
+    def get_many(cls, conversation, context_type, keys):
+        """Recupera vários contextos de um tipo em uma única query: {context_key: registro}"""
+        queryset = cls.objects.filter(
+            conversation=conversation,
+            context_type=context_type,
+            context_key__in=keys
+        )
+        return {context.context_key: context for context in queryset}
+    
     def is_expired(self):
         """Verifica se contexto expirou"""
         return self.expires_at and timezone.now() > self.expires_at
@@ -1,21 +1,349 @@
 # apps/chatbot/services/chat_service.py
 import json
+import re
 import time
 import logging
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, fields
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Dict, Iterator, List, Optional, Tuple
 from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
 from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import DurationField, ExpressionWrapper, F, Max
+from django.db.models.functions import Now
 
 from ..models import Conversation, Message, ChatContext
+from apps.core.middleware import request_now
 from apps.users.models import UserProfile
 from apps.workouts.models import Workout, WorkoutSession
 from apps.recommendations.services.ai_service import AIService
 
+try:
+    import orjson  # Parser JSON em C, opcional
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+INTENT_CACHE_TIMEOUT = 3600
+
+# Contexto inicial (perfil + treinos recentes) muda pouco; invalidado via signals
+INIT_CONTEXT_CACHE_TIMEOUT = 3600
+
+# Histórico formatado; novas mensagens trocam a versão (ver signals), então o TTL só limita memória
+HISTORY_CACHE_TIMEOUT = 300
+
+# Versão do histórico expira bem depois dos históricos que ela identifica (1 dia)
+HISTORY_VERSION_TIMEOUT = 86400
+
+# Duração da conversa em minutos calculada no banco, para o UPDATE ... RETURNING de end_conversation
+DURATION_MINUTES_SQL = {
+    'postgresql': "EXTRACT(EPOCH FROM now() - created_at) / 60",
+    'sqlite': "(julianday('now') - julianday(created_at)) * 1440",
+}
+
+# Linhas buscadas por ida ao banco ao percorrer históricos longos
+HISTORY_CHUNK_SIZE = 250
+
+# Pool compartilhado entre instâncias do serviço (criado uma vez por processo)
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='chat-service')
+
+# Palavras-chave para cada intenção (análise por regras)
+INTENT_KEYWORDS = {
+    'workout_request': ['treino', 'exercício', 'workout', 'série', 'repetição', 'treinar'],
+    'technique_question': ['como', 'técnica', 'forma', 'postura', 'execução', 'executar'],
+    'nutrition_advice': ['alimentação', 'dieta', 'nutrição', 'proteína', 'comer', 'comida'],
+    'progress_inquiry': ['progresso', 'resultado', 'evolução', 'melhora', 'crescimento'],
+    'motivation_need': ['motivação', 'desânimo', 'preguiça', 'força', 'conseguir'],
+    'equipment_question': ['equipamento', 'aparelho', 'peso', 'halteres', 'academia'],
+    'injury_concern': ['dor', 'lesão', 'machuca', 'problema', 'desconforto'],
+    'schedule_planning': ['rotina', 'horário', 'frequência', 'quando', 'quantas vezes']
+}
+
+# Índices pré-computados na importação: um único passe de regex substitui
+# os testes `keyword in message` por palavra-chave
+_KEYWORD_INTENT = {
+    keyword: intent
+    for intent, keywords in INTENT_KEYWORDS.items()
+    for keyword in keywords
+}
+_INTENT_KEYWORD_COUNTS = {intent: len(keywords) for intent, keywords in INTENT_KEYWORDS.items()}
+# Lookahead permite casamentos sobrepostos, equivalente a `keyword in message`
+_KEYWORD_RE = re.compile(
+    "(?=(%s))" % "|".join(map(re.escape, sorted(_KEYWORD_INTENT, key=len, reverse=True)))
+)
+
+# Palavras-chave de todas as intenções, para extração por palavra em O(1)
+ALL_KW = frozenset(_KEYWORD_INTENT)
+
+# Termos de urgência (casamento por substring, como em `'dor' in message`)
+_URGENCY_RE = re.compile("dor|lesão|urgente")
+
+# Tipos de contexto lidos pelo prompt de sistema (perfil e treinos, para qualquer intenção)
+PROMPT_CTX_TYPES = ('user_profile', 'workout_history')
+ALL_CONTEXT_TYPES = tuple(context_type for context_type, _ in ChatContext.CONTEXT_TYPE_CHOICES)
+
+# Preferências atualizadas a cada mensagem (context_type='preferences')
+PREFERENCE_KEYS = ('message_style', 'topics_of_interest')
+
+# Saudações e respostas curtas: analisadas só por regras, sem IA
+GREETINGS = frozenset({'oi', 'olá', 'ola', 'hi', 'hey', 'ok', 'sim', 'não', 'nao', 'valeu', 'obrigado'})
+
+
+def _normalize_message(message: str) -> str:
+    """Normaliza mensagem para uso como chave de cache (minúsculas, espaços colapsados)"""
+    return re.sub(r"\s+", " ", message.strip().lower())
+
+
+def _intent_cache_key(norm: str) -> str:
+    """Chave estável entre processos para a análise de intenção"""
+    return f"intent:{blake2b(norm.encode(), digest_size=8).hexdigest()}"
+
+
+@dataclass
+class IntentAnalysis:
+    """Formato validado da análise de intenção retornada pela IA"""
+    intent: str = 'general_question'
+    confidence: float = 0.5
+    secondary_intents: List[str] = field(default_factory=list)
+    keywords: List[str] = field(default_factory=list)
+    urgency_level: str = 'medium'
+    requires_personalization: bool = True
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'IntentAnalysis':
+        """Ignora chaves desconhecidas e completa as ausentes com os padrões"""
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+
+def _loads_json(payload):
+    """Decodifica JSON com orjson quando disponível (fallback: json da stdlib)"""
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def _estimate_tokens(content: str) -> int:
+    """Estimativa aproximada de tokens (~1.3 por palavra) sem alocar a lista de palavras"""
+    return int((content.count(' ') + 1) * 1.3)
+
+
+def _context_cache_key(conversation_id: int) -> str:
+    """Chave do contexto montado da conversa"""
+    return f"chat_context:{conversation_id}"
+
+
+def _history_cache_key(conversation_id: int) -> str:
+    """Chave das últimas mensagens da conversa já no formato do prompt"""
+    return f"chat_history:{conversation_id}"
+
+
+def init_context_cache_key(user_id: int) -> str:
+    """Chave do contexto inicial do usuário (perfil e treinos recentes)"""
+    return f"chat_init_ctx:{user_id}"
+
+
+def _history_version_key(conversation_id: int) -> str:
+    """Chave da versão do histórico da conversa"""
+    return f"chathist_version:{conversation_id}"
+
+
+def get_history_version(conversation_id: int) -> int:
+    """
+    Versão atual do histórico da conversa, usada nas chaves de cache do histórico.
+    Sem versão registrada (ou removida do cache), cria uma nova - nunca reaproveita chaves antigas.
+    """
+    version_key = _history_version_key(conversation_id)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, time.time_ns(), HISTORY_VERSION_TIMEOUT)
+        version = cache.get(version_key)
+    return version
+
+
+def bump_history_version(conversation_id: int):
+    """Invalida todos os históricos em cache da conversa (qualquer limite/offset)"""
+    cache.set(_history_version_key(conversation_id), time.time_ns(), HISTORY_VERSION_TIMEOUT)
+
+
+@lru_cache(maxsize=4096)
+def _rule_intent_cached(norm: str) -> Dict:
+    """
+    Análise de intenção baseada em regras sobre a mensagem já normalizada.
+    Função pura, memoizada em processo; listas vão como tuplas para não serem alteradas no cache.
+    """
+    # Calcular score para cada intenção (cada palavra-chave conta uma vez)
+    hit_counts = {}
+    for keyword in {match.group(1) for match in _KEYWORD_RE.finditer(norm)}:
+        intent = _KEYWORD_INTENT[keyword]
+        hit_counts[intent] = hit_counts.get(intent, 0) + 1
+    
+    intent_scores = {
+        intent: hit_counts[intent] / keyword_count
+        for intent, keyword_count in _INTENT_KEYWORD_COUNTS.items()
+        if intent in hit_counts
+    }
+    
+    # Determinar intenção principal
+    if intent_scores:
+        main_intent = max(intent_scores, key=intent_scores.get)
+        confidence = intent_scores[main_intent]
+    else:
+        main_intent = 'general_question'
+        confidence = 0.5
+    
+    return {
+        'intent': main_intent,
+        'confidence': confidence,
+        'secondary_intents': tuple(intent for intent, score in intent_scores.items() 
+                                   if intent != main_intent and score > 0.2),
+        'keywords': tuple(word for word in norm.split() if word in ALL_KW),
+        'urgency_level': 'high' if _URGENCY_RE.search(norm) else 'medium',
+        'requires_personalization': True
+    }
+
+
+BASE_FITNESS_PROMPT = """Você é Alex, um personal trainer virtual especialista em fitness com 10 anos de experiência.
+
+PERSONALIDADE:
+- Amigável, motivador e profissional
+- Usa linguagem clara e acessível
+- Encoraja sem ser excessivo
+- Foca na segurança e na progressão gradual
+- Baseado em evidência científica
+
+DIRETRIZES DE RESPOSTA:
+- Máximo 200 palavras por resposta
+- Use emojis ocasionalmente para engajamento
+- Seja específico e prático
+- Sempre priorize a segurança
+- Adapte ao nível do usuário"""
+
+# Contexto adicional do prompt baseado na intenção
+INTENT_CONTEXTS = {
+    'workout_request': "\nFOCO: Recomende exercícios seguros e progressivos. Sempre inclua aquecimento e alongamento.",
+    'technique_question': "\nFOCO: Explique técnica com clareza, enfatize segurança e sugira progressões.",
+    'nutrition_advice': "\nFOCO: Dê orientações gerais, sempre recomende consulta com nutricionista para planos específicos.",
+    'progress_inquiry': "\nFOCO: Analise dados disponíveis, celebre conquistas e sugira próximos passos.",
+    'motivation_need': "\nFOCO: Seja encorajador, lembre dos benefícios e sugira estratégias práticas.",
+    'injury_concern': "\nFOCO: Priorize segurança, recomende descanso se necessário e consulta profissional."
+}
+
+
+# Mensagens de boas-vindas pré-definidas (fallback), formatadas com o nome do usuário
+_WELCOME_TEMPLATES = {
+    'workout_consultation': "Olá, {name}! 💪 Sou Alex, seu personal trainer virtual. Estou aqui para ajudar você a criar treinos personalizados e alcançar seus objetivos. Como posso te ajudar hoje?",
+
+    'progress_analysis': "Oi, {name}! 📈 Que bom te ver aqui! Vamos analisar seu progresso e ver como você está evoluindo. Tenho algumas perguntas para entender melhor sua jornada. Pronto para começar?",
+
+    'motivation_chat': "Hey, {name}! 🌟 Às vezes todos precisamos de um empurrãozinho, né? Estou aqui para te motivar e lembrar do incrível que você é. Vamos conversar sobre o que está te preocupando?",
+
+    'technique_guidance': "Salve, {name}! 🎯 Técnica correta é tudo no fitness! Estou aqui para te ajudar com dúvidas sobre execução de exercícios e boa forma. Qual movimento você gostaria de aperfeiçoar?",
+
+    'general_fitness': "Olá, {name}! 🏃‍♂️ Bem-vindo(a) ao seu chat fitness personalizado! Sou Alex e estou aqui para tirar dúvidas, sugerir treinos e te apoiar nessa jornada. O que você gostaria de saber?"
+}
+
+
+@lru_cache(maxsize=1024)
+def _render_welcome_message(conversation_type: str, user_name: str) -> str:
+    """Formata apenas o template do tipo de conversa (memoizado por tipo e nome)"""
+    template = _WELCOME_TEMPLATES.get(conversation_type, _WELCOME_TEMPLATES['general_fitness'])
+    return template.format(name=user_name)
+
+
+@lru_cache(maxsize=1024)
+def _compose_prompt(goal: Optional[str], level: Optional[str], intent: str, history_len: int) -> str:
+    """Monta o prompt de sistema; memoizado pois muitas mensagens compartilham os mesmos parâmetros"""
+    parts = [BASE_FITNESS_PROMPT]
+    
+    # Adicionar contexto específico
+    if goal:
+        parts.append(f"\n\nOBJETIVO DO USUÁRIO: {goal}")
+    
+    if level:
+        parts.append(f"\nNÍVEL ATUAL: {level}")
+    
+    parts.append(INTENT_CONTEXTS.get(intent, ''))
+    
+    if history_len:
+        parts.append(f"\n\nHISTÓRICO RECENTE: {history_len} treinos realizados recentemente.")
+    
+    parts.append("\n\nSempre termine perguntando se precisa de mais alguma coisa ou esclarecimento adicional.")
+    
+    return "".join(parts)
+
+
+# Padrões de ações sugeridas e exercícios detectados nas respostas da IA
+ACTION_PATTERNS = {
+    'try_exercise': ['experimente', 'tente fazer', 'faça'],
+    'rest_recovery': ['descanse', 'pause', 'recuperação'],
+    'seek_professional': ['consulte', 'procure um', 'médico', 'fisioterapeuta'],
+    'schedule_workout': ['agende', 'planeje', 'organize'],
+    'track_progress': ['anote', 'registre', 'acompanhe']
+}
+COMMON_EXERCISES = ['agachamento', 'flexão', 'corrida', 'caminhada', 'prancha', 'abdominais']
+
+# Lookahead permite casamentos sobrepostos, equivalente a `pattern in response`
+ACTION_RE = re.compile("(?=(?:%s))" % "|".join(
+    f"(?P<{action}>{'|'.join(map(re.escape, patterns))})"
+    for action, patterns in ACTION_PATTERNS.items()
+))
+EXERCISE_RE = re.compile("|".join(map(re.escape, COMMON_EXERCISES)))
+
+
+class _ContextUpdateQueue:
+    """
+    Fila em processo das atualizações de contexto (CHATBOT_ASYNC_CONTEXT_UPDATES).
+    O turno apenas enfileira; um worker do executor grava em lote tudo o que acumulou.
+    """
+    
+    def __init__(self, batch_size: int = 100):
+        self.batch_size = batch_size
+        self._items = []
+        self._lock = threading.Lock()
+        self._draining = False
+    
+    def put(self, service: 'ChatService', item: Tuple[Conversation, str, Dict]):
+        """Enfileira (conversa, mensagem, análise de intenção) e agenda o worker se necessário"""
+        with self._lock:
+            self._items.append(item)
+            if self._draining:
+                return
+            self._draining = True
+        
+        service._executor.submit(self._drain, service)
+    
+    def _drain(self, service: 'ChatService'):
+        """Grava a fila em lotes até esvaziá-la"""
+        try:
+            while True:
+                with self._lock:
+                    batch = self._items[:self.batch_size]
+                    del self._items[:self.batch_size]
+                    if not batch:
+                        self._draining = False
+                        return
+                
+                service.bulk_update_contexts(batch)
+        except Exception as e:
+            logger.error(f"Error draining context update queue: {e}")
+            with self._lock:
+                self._draining = False
+        finally:
+            # Conexão aberta por esta thread do executor não é fechada pelo ciclo de requisição
+            connections.close_all()
+
+
+_context_update_queue = _ContextUpdateQueue()
+
 
 class ChatService:
     """
@@ -25,8 +353,12 @@ class ChatService:
     
     def __init__(self):
         self.ai_service = AIService()
+        self._executor = _executor
         self.max_context_messages = 10
         self.conversation_timeout_hours = 24
+        self.request_cache_timeout = getattr(settings, 'CACHE_TIMEOUTS', {}).get('chatbot_context', 3600)
+        self.ai_model = getattr(settings, 'OPENAI_MODEL', 'gpt-3.5-turbo')
+        self.async_context_updates = getattr(settings, 'CHATBOT_ASYNC_CONTEXT_UPDATES', False)
         
     def start_conversation(self, user: User, conversation_type: str = 'general_fitness',
                           initial_message: str = None) -> Dict:
@@ -38,15 +370,15 @@ class ChatService:
             recent_conversation = Conversation.objects.filter(
                 user=user,
                 status='active',
-                created_at__gte=timezone.now() - timedelta(hours=2)
-            ).first()
+                created_at__gte=request_now() - timedelta(hours=2)
+            ).order_by('-created_at').values('id', 'conversation_type').first()
             
             if recent_conversation and not initial_message:
                 return {
-                    'conversation_id': recent_conversation.id,
+                    'conversation_id': recent_conversation['id'],
                     'status': 'resumed',
                     'message': 'Continuando conversa anterior...',
-                    'conversation_type': recent_conversation.conversation_type,
+                    'conversation_type': recent_conversation['conversation_type'],
                     'context_loaded': True
                 }
             
@@ -54,7 +386,7 @@ class ChatService:
             conversation = Conversation.objects.create(
                 user=user,
                 conversation_type=conversation_type,
-                ai_model_used=getattr(settings, 'OPENAI_MODEL', 'gpt-3.5-turbo')
+                ai_model_used=self.ai_model
             )
             
             # Carregar contexto inicial do usuário
@@ -95,10 +427,29 @@ class ChatService:
         """
         Processa mensagem do usuário e gera resposta da IA
         """
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
+        
+        # Cache por requisição: todas as chaves do turno buscadas em uma ida ao cache
+        request_cache, cache_hits = {}, {}
+        history_key = _history_cache_key(conversation_id)
         
         try:
-            conversation = Conversation.objects.get(id=conversation_id)
+            request_cache = self._read_request_cache(conversation_id, message)
+            cache_hits = dict(request_cache)
+            
+            # Usuário carregado no mesmo SELECT (usado nas respostas de fallback)
+            conversation = Conversation.objects.select_related('user').only(
+                'id', 'title', 'status', 'conversation_type', 'expires_at', 'last_activity_at',
+                'message_count', 'ai_responses_count', 'ai_model_used', 'created_at',
+                'user__id', 'user__first_name'
+            ).filter(id=conversation_id).first()
+            
+            # Conversa inexistente tratada sem exceção
+            if conversation is None:
+                return {
+                    'error': 'Conversa não encontrada',
+                    'suggestion': 'Verifique o ID da conversa ou inicie uma nova'
+                }
             
             # Verificar se conversa não expirou
             if conversation.is_expired():
@@ -107,49 +458,62 @@ class ChatService:
                     'suggestion': 'Inicie uma nova conversa para continuar'
                 }
             
-            # Salvar mensagem do usuário
-            user_message = self._save_user_message(conversation, message)
+            # Detectar intenção (cache/OpenAI) apenas para conversas válidas
+            intent_future = self._executor.submit(
+                self._analyze_message_intent, message, conversation, cached=request_cache
+            )
+            intent_analysis = intent_future.result()
             
-            # Detectar intenção e contexto
-            intent_analysis = self._analyze_message_intent(message, conversation)
-            user_message.intent_detected = intent_analysis.get('intent', 'general_question')
-            user_message.save()
+            # Salvar mensagem do usuário já com a intenção (um único INSERT)
+            self._save_user_message(
+                conversation, message,
+                intent=intent_analysis.get('intent', 'general_question')
+            )
             
             # Atualizar contexto da conversa
-            self._update_conversation_context(conversation, message, intent_analysis)
+            self._update_conversation_context(conversation, message, intent_analysis, cached=request_cache)
             
             # Gerar resposta da IA
-            ai_response = self._generate_ai_response(conversation, message, intent_analysis)
+            ai_response = self._generate_ai_response(conversation, message, intent_analysis, cached=request_cache)
             
             if ai_response and ai_response.get('success'):
+                # Tempo de resposta medido uma vez (relógio monotônico) e reutilizado
+                elapsed_ms = round((time.perf_counter_ns() - start_ns) / 1e6, 2)
+                
                 # Salvar resposta da IA
                 ai_message = self._save_ai_message(
                     conversation,
                     ai_response['content'],
-                    response_time_ms=round((time.time() - start_time) * 1000, 2),
+                    response_time_ms=elapsed_ms,
                     confidence_score=ai_response.get('confidence_score', 0.8),
                     intent=intent_analysis.get('intent')
                 )
                 
+                # Histórico em cache passa a incluir a resposta da IA
+                history = deque(request_cache[history_key], maxlen=6)
+                history.append({'role': 'assistant', 'content': ai_response['content']})
+                request_cache[history_key] = list(history)
+                
                 return {
                     'message_id': ai_message.id,
                     'response': ai_response['content'],
                     'conversation_updated': True,
                     'intent_detected': intent_analysis.get('intent'),
                     'confidence_score': ai_response.get('confidence_score'),
-                    'response_time_ms': round((time.time() - start_time) * 1000, 2),
+                    'response_time_ms': elapsed_ms,
                     'suggested_actions': ai_response.get('suggested_actions', []),
                     'workout_references': ai_response.get('workout_references', []),
                     'method': 'ai_powered'
                 }
             else:
                 # Fallback para resposta baseada em regras
+                request_cache.pop(history_key, None)
                 fallback_response = self._generate_fallback_response(conversation, message, intent_analysis)
                 
                 ai_message = self._save_ai_message(
                     conversation,
                     fallback_response,
-                    response_time_ms=round((time.time() - start_time) * 1000, 2),
+                    response_time_ms=round((time.perf_counter_ns() - start_ns) / 1e6, 2),
                     confidence_score=0.6,
                     intent=intent_analysis.get('intent')
                 )
@@ -163,17 +527,47 @@ class ChatService:
                     'note': 'IA temporariamente indisponível'
                 }
                 
-        except Conversation.DoesNotExist:
-            return {
-                'error': 'Conversa não encontrada',
-                'suggestion': 'Verifique o ID da conversa ou inicie uma nova'
-            }
         except Exception as e:
             logger.error(f"Error processing message in conversation {conversation_id}: {e}")
+            request_cache.pop(history_key, None)
             return {
                 'error': 'Erro ao processar mensagem',
                 'suggestion': 'Tente novamente ou reformule sua pergunta'
             }
+        finally:
+            self._write_back_request_cache(request_cache, cache_hits)
+    
+    def _request_cache_keys(self, conversation_id: int, msg_norm: str) -> List[str]:
+        """Chaves de cache usadas em um turno: [intenção, contexto, histórico]"""
+        return [
+            _intent_cache_key(msg_norm),
+            _context_cache_key(conversation_id),
+            _history_cache_key(conversation_id),
+        ]
+    
+    def _read_request_cache(self, conversation_id: int, message: str) -> Dict:
+        """Busca as chaves do turno com get_many; falha no cache segue o turno com cache vazio"""
+        try:
+            return cache.get_many(self._request_cache_keys(conversation_id, _normalize_message(message)))
+        except Exception as e:
+            logger.error(f"Error reading chat request cache: {e}")
+            return {}
+    
+    def _write_back_request_cache(self, request_cache: Dict, cache_hits: Dict):
+        """Grava valores novos com set_many e remove entradas invalidadas durante o turno"""
+        try:
+            fresh = {
+                key: value for key, value in request_cache.items()
+                if cache_hits.get(key) is not value
+            }
+            stale = [key for key in cache_hits if key not in request_cache]
+            
+            if fresh:
+                cache.set_many(fresh, self.request_cache_timeout)
+            if stale:
+                cache.delete_many(stale)
+        except Exception as e:
+            logger.error(f"Error writing back chat request cache: {e}")
     
     def _initialize_conversation_context(self, conversation: Conversation):
         """
@@ -182,88 +576,106 @@ class ChatService:
         try:
             user = conversation.user
             
-            # Contexto do perfil do usuário
-            try:
-                profile = UserProfile.objects.get(user=user)
-                ChatContext.set_context(
-                    conversation, 'user_profile', 'basic_info',
-                    {
-                        'goal': profile.goal,
-                        'activity_level': profile.activity_level,
-                        'focus_areas': profile.focus_areas,
-                        'age': profile.age,
-                        'current_weight': profile.current_weight,
-                        'target_weight': profile.target_weight,
-                    },
-                    relevance=1.0
-                )
-            except UserProfile.DoesNotExist:
-                ChatContext.set_context(
-                    conversation, 'user_profile', 'basic_info',
-                    {'profile_complete': False},
-                    relevance=0.5
-                )
-            
-            # Contexto do histórico de treinos (últimos 7 dias)
-            recent_sessions = WorkoutSession.objects.filter(
-                user=user,
-                completed=True,
-                completed_at__gte=timezone.now() - timedelta(days=7)
-            ).order_by('-completed_at')[:5]
-            
-            workout_history = []
-            for session in recent_sessions:
-                workout_history.append({
-                    'workout_name': session.workout.name if session.workout else 'Treino Personalizado',
-                    'completed_at': session.completed_at.strftime('%d/%m/%Y'),
-                    'rating': session.user_rating,
-                    'duration': session.actual_duration
-                })
-            
-            ChatContext.set_context(
-                conversation, 'workout_history', 'recent_workouts',
-                {'recent_sessions': workout_history},
-                relevance=0.8
+            # Perfil e treinos recentes vêm do cache quando possível (1 GET em vez de 2 SELECTs)
+            contexts = cache.get_or_set(
+                init_context_cache_key(user.id),
+                lambda: self._compute_init_context(user),
+                INIT_CONTEXT_CACHE_TIMEOUT
             )
             
-            # Preferências conversacionais (será atualizado durante a conversa)
-            ChatContext.set_context(
-                conversation, 'preferences', 'conversation_style',
-                {'preferred_response_length': 'medium', 'technical_level': 'intermediate'},
-                relevance=0.6
-            )
+            # Gravar os três contextos em uma única query
+            ChatContext.bulk_set_contexts(conversation, contexts)
             
         except Exception as e:
             logger.error(f"Error initializing conversation context: {e}")
     
-    def _analyze_message_intent(self, message: str, conversation: Conversation) -> Dict:
+    def _compute_init_context(self, user: User) -> List[Tuple]:
+        """
+        Monta os contextos iniciais como tuplas (tipo, chave, valor, relevância)
+        """
+        # Contexto do perfil do usuário
+        try:
+            profile = UserProfile.objects.only(
+                'goal', 'activity_level', 'focus_areas', 'current_weight', 'target_weight'
+            ).get(user=user)
+            profile_context = ('user_profile', 'basic_info', {
+                'goal': profile.goal,
+                'activity_level': profile.activity_level,
+                'focus_areas': profile.focus_areas,
+                'current_weight': profile.current_weight,
+                'target_weight': profile.target_weight,
+            }, 1.0)
+        except UserProfile.DoesNotExist:
+            profile_context = ('user_profile', 'basic_info', {'profile_complete': False}, 0.5)
+        
+        # Contexto do histórico de treinos (últimos 7 dias) - treino carregado no mesmo SELECT
+        recent_sessions = WorkoutSession.objects.filter(
+            user=user,
+            completed=True,
+            completed_at__gte=timezone.now() - timedelta(days=7)
+        ).select_related('workout').only(
+            'completed_at', 'user_rating', 'duration_minutes', 'workout__name'
+        ).order_by('-completed_at')[:5]
+        
+        workout_history = [
+            {
+                'workout_name': session.workout.name if session.workout else 'Treino Personalizado',
+                'completed_at': session.completed_at.strftime('%d/%m/%Y'),
+                'rating': session.user_rating,
+                'duration': session.duration_minutes
+            }
+            for session in recent_sessions
+        ]
+        
+        return [
+            profile_context,
+            ('workout_history', 'recent_workouts', {'recent_sessions': workout_history}, 0.8),
+            # Preferências conversacionais (será atualizado durante a conversa)
+            ('preferences', 'conversation_style',
+             {'preferred_response_length': 'medium', 'technical_level': 'intermediate'}, 0.6),
+        ]
+    
+    def _analyze_message_intent(self, message: str, conversation: Optional[Conversation] = None,
+                                cached: Optional[Dict] = None) -> Dict:
         """
         Analisa intenção da mensagem usando IA ou regras
+        cached: cache da requisição (get_many) - quando fornecido, gravação fica a cargo de quem chamou
         """
         try:
-            # Cache da análise por 1 hora
-            cache_key = f"intent_analysis_{hash(message.lower())}"
-            cached_intent = cache.get(cache_key)
-            if cached_intent:
-                return cached_intent
+            norm = _normalize_message(message)
+            
+            # Caminho rápido: mensagens muito curtas ou saudações dispensam a IA (regras memoizadas)
+            if len(norm) < 8 or norm in GREETINGS:
+                return self._rule_based_intent_analysis(message)
+            
+            cache_key = _intent_cache_key(norm)
             
-            # Tentar análise com IA
+            # Tentar análise com IA (cache compartilhado entre processos por 1 hora)
             if self.ai_service.is_available:
-                ai_intent = self._ai_intent_analysis(message, conversation)
+                if cached is None:
+                    ai_intent = cache.get_or_set(
+                        cache_key,
+                        lambda: self._ai_intent_analysis(message, conversation),
+                        INTENT_CACHE_TIMEOUT
+                    )
+                else:
+                    ai_intent = cached.get(cache_key)
+                    if not ai_intent:
+                        ai_intent = self._ai_intent_analysis(message, conversation)
+                        if ai_intent:
+                            cached[cache_key] = ai_intent
+                
                 if ai_intent:
-                    cache.set(cache_key, ai_intent, 3600)
                     return ai_intent
             
-            # Fallback: análise por regras
-            rule_intent = self._rule_based_intent_analysis(message)
-            cache.set(cache_key, rule_intent, 1800)  # Cache menor para fallback
-            return rule_intent
+            # Fallback: análise por regras (memoizada em processo, sem ida ao cache)
+            return self._rule_based_intent_analysis(message)
             
         except Exception as e:
             logger.error(f"Error analyzing message intent: {e}")
             return {'intent': 'general_question', 'confidence': 0.5}
     
-    def _ai_intent_analysis(self, message: str, conversation: Conversation) -> Optional[Dict]:
+    def _ai_intent_analysis(self, message: str, conversation: Optional[Conversation] = None) -> Optional[Dict]:
         """
         Análise de intenção usando IA
         """
@@ -304,7 +716,9 @@ Responda em JSON:
             response = self.ai_service._make_openai_request(messages, max_tokens=200, temperature=0.3)
             
             if response:
-                return json.loads(response)
+                parsed = _loads_json(response)
+                if isinstance(parsed, dict):
+                    return asdict(IntentAnalysis.from_dict(parsed))
                 
         except Exception as e:
             logger.error(f"Error in AI intent analysis: {e}")
@@ -315,47 +729,13 @@ Responda em JSON:
         """
         Análise de intenção baseada em regras
         """
-        message_lower = message.lower()
-        
-        # Palavras-chave para cada intenção
-        intent_keywords = {
-            'workout_request': ['treino', 'exercício', 'workout', 'série', 'repetição', 'treinar'],
-            'technique_question': ['como', 'técnica', 'forma', 'postura', 'execução', 'executar'],
-            'nutrition_advice': ['alimentação', 'dieta', 'nutrição', 'proteína', 'comer', 'comida'],
-            'progress_inquiry': ['progresso', 'resultado', 'evolução', 'melhora', 'crescimento'],
-            'motivation_need': ['motivação', 'desânimo', 'preguiça', 'força', 'conseguir'],
-            'equipment_question': ['equipamento', 'aparelho', 'peso', 'halteres', 'academia'],
-            'injury_concern': ['dor', 'lesão', 'machuca', 'problema', 'desconforto'],
-            'schedule_planning': ['rotina', 'horário', 'frequência', 'quando', 'quantas vezes']
-        }
-        
-        # Calcular score para cada intenção
-        intent_scores = {}
-        for intent, keywords in intent_keywords.items():
-            score = sum([1 for keyword in keywords if keyword in message_lower])
-            if score > 0:
-                intent_scores[intent] = score / len(keywords)
-        
-        # Determinar intenção principal
-        if intent_scores:
-            main_intent = max(intent_scores, key=intent_scores.get)
-            confidence = intent_scores[main_intent]
-        else:
-            main_intent = 'general_question'
-            confidence = 0.5
-        
-        return {
-            'intent': main_intent,
-            'confidence': confidence,
-            'secondary_intents': [intent for intent, score in intent_scores.items() 
-                                 if intent != main_intent and score > 0.2],
-            'keywords': [word for word in message_lower.split() 
-                        if any(word in keywords for keywords in intent_keywords.values())],
-            'urgency_level': 'high' if any(word in message_lower for word in ['dor', 'lesão', 'urgente']) else 'medium',
-            'requires_personalization': True
-        }
+        analysis = dict(_rule_intent_cached(_normalize_message(message)))
+        analysis['secondary_intents'] = list(analysis['secondary_intents'])
+        analysis['keywords'] = list(analysis['keywords'])
+        return analysis
     
-    def _generate_ai_response(self, conversation: Conversation, message: str, intent_analysis: Dict) -> Optional[Dict]:
+    def _generate_ai_response(self, conversation: Conversation, message: str, intent_analysis: Dict,
+                              cached: Optional[Dict] = None) -> Optional[Dict]:
         """
         Gera resposta usando IA com contexto completo
         """
@@ -364,28 +744,22 @@ Responda em JSON:
         
         try:
             # Buscar contexto da conversa
-            context_data = self._build_conversation_context(conversation)
+            context_data = self._build_conversation_context(
+                conversation, intent=intent_analysis.get('intent'), cached=cached
+            )
             
-            # Buscar mensagens recentes para contexto
-            recent_messages = conversation.get_last_messages(8)
-            conversation_history = []
-            for msg in reversed(recent_messages):
-                conversation_history.append({
-                    'role': 'user' if msg.message_type == 'user' else 'assistant',
-                    'content': msg.content
-                })
+            # Mensagens recentes para contexto (últimas 6, em ordem cronológica)
+            conversation_history = self._get_prompt_history(conversation, message, cached)
             
             # Prompt otimizado para chat fitness
             system_prompt = self._build_fitness_chat_system_prompt(intent_analysis, context_data)
             
-            # Construir mensagens para IA
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            # Adicionar histórico da conversa (limitado)
-            messages.extend(conversation_history[-6:])  # Últimas 6 mensagens
-            
-            # Mensagem atual do usuário
-            messages.append({"role": "user", "content": message})
+            # Construir mensagens para IA: sistema, histórico (limitado) e mensagem atual do usuário
+            messages = [
+                {"role": "system", "content": system_prompt},
+                *conversation_history,
+                {"role": "user", "content": message}
+            ]
             
             response = self.ai_service._make_openai_request(
                 messages, 
@@ -403,56 +777,47 @@ Responda em JSON:
         
         return None
     
-    def _build_fitness_chat_system_prompt(self, intent_analysis: Dict, context_data: Dict) -> str:
+    def _get_prompt_history(self, conversation: Conversation, message: str,
+                            cached: Optional[Dict] = None) -> List[Dict]:
         """
-        Constrói prompt de sistema otimizado para chat fitness
+        Últimas 6 mensagens no formato do prompt, incluindo a mensagem atual do usuário.
+        Usa o histórico em cache do turno anterior quando disponível.
         """
-        user_profile = context_data.get('user_profile', {})
-        workout_history = context_data.get('workout_history', {})
-        
-        base_prompt = """Você é Alex, um personal trainer virtual especialista em fitness com 10 anos de experiência.
-
-PERSONALIDADE:
-- Amigável, motivador e profissional
-- Usa linguagem clara e acessível
-- Encoraja sem ser excessivo
-- Foca na segurança e na progressão gradual
-- Baseado em evidência científica
-
-DIRETRIZES DE RESPOSTA:
-- Máximo 200 palavras por resposta
-- Use emojis ocasionalmente para engajamento
-- Seja específico e prático
-- Sempre priorize a segurança
-- Adapte ao nível do usuário"""
+        cache_key = _history_cache_key(conversation.id)
         
-        # Adicionar contexto específico
-        if user_profile.get('goal'):
-            base_prompt += f"\n\nOBJETIVO DO USUÁRIO: {user_profile['goal']}"
-        
-        if user_profile.get('activity_level'):
-            base_prompt += f"\nNÍVEL ATUAL: {user_profile['activity_level']}"
-        
-        # Contexto baseado na intenção
-        intent_contexts = {
-            'workout_request': "\nFOCO: Recomende exercícios seguros e progressivos. Sempre inclua aquecimento e alongamento.",
-            'technique_question': "\nFOCO: Explique técnica com clareza, enfatize segurança e sugira progressões.",
-            'nutrition_advice': "\nFOCO: Dê orientações gerais, sempre recomende consulta com nutricionista para planos específicos.",
-            'progress_inquiry': "\nFOCO: Analise dados disponíveis, celebre conquistas e sugira próximos passos.",
-            'motivation_need': "\nFOCO: Seja encorajador, lembre dos benefícios e sugira estratégias práticas.",
-            'injury_concern': "\nFOCO: Priorize segurança, recomende descanso se necessário e consulta profissional."
-        }
-        
-        intent = intent_analysis.get('intent', 'general_question')
-        if intent in intent_contexts:
-            base_prompt += intent_contexts[intent]
+        # Deque limitado descarta as mensagens mais antigas sem fatiar listas
+        if cached is not None and cache_key in cached:
+            history = deque(cached[cache_key], maxlen=6)
+            history.append({'role': 'user', 'content': message})
+        else:
+            # Mensagens vêm da mais recente para a mais antiga
+            history = deque(maxlen=6)
+            for msg in conversation.get_last_messages(6):
+                history.appendleft({
+                    'role': 'user' if msg.message_type == 'user' else 'assistant',
+                    'content': msg.content
+                })
         
-        if workout_history.get('recent_sessions'):
-            base_prompt += f"\n\nHISTÓRICO RECENTE: {len(workout_history['recent_sessions'])} treinos realizados recentemente."
+        history = list(history)
+        if cached is not None:
+            cached[cache_key] = history
         
-        base_prompt += "\n\nSempre termine perguntando se precisa de mais alguma coisa ou esclarecimento adicional."
+        return history
+    
+    def _build_fitness_chat_system_prompt(self, intent_analysis: Dict, context_data: Dict) -> str:
+        """
+        Constrói prompt de sistema otimizado para chat fitness
+        """
+        # Valores ficam sob a chave de cada contexto (ver _compute_init_context)
+        user_profile = context_data.get('user_profile', {}).get('basic_info', {})
+        workout_history = context_data.get('workout_history', {}).get('recent_workouts', {})
         
-        return base_prompt
+        return _compose_prompt(
+            user_profile.get('goal'),
+            user_profile.get('activity_level'),
+            intent_analysis.get('intent', 'general_question'),
+            len(workout_history.get('recent_sessions') or [])
+        )
     
     def _process_ai_response(self, response: str, intent_analysis: Dict) -> Dict:
         """
@@ -466,31 +831,16 @@ DIRETRIZES DE RESPOSTA:
             'workout_references': []
         }
         
-        # Detectar ações sugeridas na resposta
+        # Detectar ações sugeridas na resposta (um único passe de regex)
         response_lower = response.lower()
         
-        action_patterns = {
-            'try_exercise': ['experimente', 'tente fazer', 'faça'],
-            'rest_recovery': ['descanse', 'pause', 'recuperação'],
-            'seek_professional': ['consulte', 'procure um', 'médico', 'fisioterapeuta'],
-            'schedule_workout': ['agende', 'planeje', 'organize'],
-            'track_progress': ['anote', 'registre', 'acompanhe']
-        }
-        
-        for action, patterns in action_patterns.items():
-            if any(pattern in response_lower for pattern in patterns):
-                processed['suggested_actions'].append(action)
+        found_actions = {match.lastgroup for match in ACTION_RE.finditer(response_lower)}
+        processed['suggested_actions'] = [action for action in ACTION_PATTERNS if action in found_actions]
         
         # Detectar referências a exercícios/treinos específicos
         # (Pode ser expandido com NLP mais sofisticado)
-        exercise_mentions = []
-        common_exercises = ['agachamento', 'flexão', 'corrida', 'caminhada', 'prancha', 'abdominais']
-        
-        for exercise in common_exercises:
-            if exercise in response_lower:
-                exercise_mentions.append(exercise)
-        
-        processed['workout_references'] = exercise_mentions
+        found_exercises = set(EXERCISE_RE.findall(response_lower))
+        processed['workout_references'] = [exercise for exercise in COMMON_EXERCISES if exercise in found_exercises]
         
         return processed
     
@@ -535,19 +885,7 @@ DIRETRIZES DE RESPOSTA:
                     return ai_welcome
             
             # Fallback: mensagens pré-definidas
-            type_messages = {
-                'workout_consultation': f"Olá, {user_name}! 💪 Sou Alex, seu personal trainer virtual. Estou aqui para ajudar você a criar treinos personalizados e alcançar seus objetivos. Como posso te ajudar hoje?",
-                
-                'progress_analysis': f"Oi, {user_name}! 📈 Que bom te ver aqui! Vamos analisar seu progresso e ver como você está evoluindo. Tenho algumas perguntas para entender melhor sua jornada. Pronto para começar?",
-                
-                'motivation_chat': f"Hey, {user_name}! 🌟 Às vezes todos precisamos de um empurrãozinho, né? Estou aqui para te motivar e lembrar do incrível que você é. Vamos conversar sobre o que está te preocupando?",
-                
-                'technique_guidance': f"Salve, {user_name}! 🎯 Técnica correta é tudo no fitness! Estou aqui para te ajudar com dúvidas sobre execução de exercícios e boa forma. Qual movimento você gostaria de aperfeiçoar?",
-                
-                'general_fitness': f"Olá, {user_name}! 🏃‍♂️ Bem-vindo(a) ao seu chat fitness personalizado! Sou Alex e estou aqui para tirar dúvidas, sugerir treinos e te apoiar nessa jornada. O que você gostaria de saber?"
-            }
-            
-            welcome_content = type_messages.get(conversation_type, type_messages['general_fitness'])
+            welcome_content = _render_welcome_message(conversation_type, user_name)
             
             return {
                 'content': welcome_content,
@@ -608,12 +946,13 @@ REQUISITOS:
         
         return None
     
-    def _save_user_message(self, conversation: Conversation, content: str) -> Message:
+    def _save_user_message(self, conversation: Conversation, content: str, intent: str = None) -> Message:
         """Salva mensagem do usuário"""
         return Message.objects.create(
             conversation=conversation,
             message_type='user',
             content=content,
+            intent_detected=intent,
             status='delivered'
         )
     
@@ -626,114 +965,313 @@ REQUISITOS:
             message_type='ai',
             content=content,
             confidence_score=confidence_score,
-            ai_model_version=getattr(settings, 'OPENAI_MODEL', 'gpt-3.5-turbo'),
+            ai_model_version=self.ai_model,
             response_time_ms=response_time_ms,
-            tokens_used=len(content.split()) * 1.3,  # Estimativa aproximada
+            tokens_used=_estimate_tokens(content),
             intent_detected=intent,
             status='delivered'
         )
     
-    def _build_conversation_context(self, conversation: Conversation) -> Dict:
-        """Constrói contexto completo da conversa"""
-        context_data = {}
+    def _build_conversation_context(self, conversation: Conversation, intent: Optional[str] = None,
+                                    cached: Optional[Dict] = None) -> Dict:
+        """
+        Constrói contexto da conversa
+        intent: quando informada, carrega apenas os tipos de contexto lidos pelo prompt
+        """
+        needed = PROMPT_CTX_TYPES if intent else ALL_CONTEXT_TYPES
         
-        # Buscar todos os contextos ativos
-        contexts = ChatContext.get_context(conversation)
+        # Em cache cada tipo já carregado tem sua entrada (vazia se não houver registros)
+        cache_key = _context_cache_key(conversation.id)
+        context_data = dict(cached.get(cache_key) or {}) if cached is not None else {}
+        missing = [context_type for context_type in needed if context_type not in context_data]
         
-        for context in contexts:
-            context_type = context.context_type
-            if context_type not in context_data:
+        if missing:
+            for context_type in missing:
                 context_data[context_type] = {}
-            context_data[context_type][context.context_key] = context.context_value
+            
+            # Buscar apenas os tipos ausentes (e apenas as colunas usadas)
+            contexts = ChatContext.get_context(conversation).filter(
+                context_type__in=missing
+            ).only('context_type', 'context_key', 'context_value')
+            
+            for context in contexts:
+                context_data[context.context_type][context.context_key] = context.context_value
+            
+            if cached is not None:
+                cached[cache_key] = context_data
         
-        return context_data
+        # Apenas tipos com registros (vazios só ficam no cache da requisição)
+        return {context_type: context_data[context_type] for context_type in needed if context_data[context_type]}
     
-    def _update_conversation_context(self, conversation: Conversation, message: str, intent_analysis: Dict):
+    def _update_conversation_context(self, conversation: Conversation, message: str, intent_analysis: Dict,
+                                     cached: Optional[Dict] = None):
         """Atualiza contexto da conversa baseado na mensagem atual"""
         try:
-            # Atualizar preferências conversacionais
-            message_length = len(message.split())
-            if message_length > 20:
-                ChatContext.set_context(
-                    conversation, 'preferences', 'message_style',
-                    {'prefers_detailed': True, 'last_message_length': message_length},
-                    relevance=0.7
-                )
+            # Nada a gravar: mensagem curta e sem intenção detectada
+            if len(message.split()) <= 20 and not intent_analysis.get('intent'):
+                return
+            
+            # Fora do caminho crítico: gravação em lote pelo worker (preferências em cache deixam de valer)
+            if self.async_context_updates:
+                _context_update_queue.put(self, (conversation, message, intent_analysis))
+                self._drop_cached_preferences(conversation, cached)
+                return
             
-            # Atualizar tópicos de interesse
-            intent = intent_analysis.get('intent')
-            if intent:
-                current_topics = ChatContext.get_context(
-                    conversation, 'preferences', 'topics_of_interest'
-                ).first()
+            # Leitura e escritas em uma única transação (um commit por turno; rollback em caso de erro)
+            with transaction.atomic():
+                # Preferências existentes lidas em uma única query
+                current = ChatContext.get_many(conversation, 'preferences', PREFERENCE_KEYS)
                 
-                if current_topics:
-                    topics = current_topics.context_value.get('topics', [])
-                    if intent not in topics:
-                        topics.append(intent)
-                        topics = topics[-5:]  # Manter últimos 5 tópicos
-                    
-                    ChatContext.set_context(
-                        conversation, 'preferences', 'topics_of_interest',
-                        {'topics': topics},
-                        relevance=0.6
-                    )
-                else:
-                    ChatContext.set_context(
-                        conversation, 'preferences', 'topics_of_interest',
-                        {'topics': [intent]},
-                        relevance=0.6
-                    )
+                # Todas as escritas em um único INSERT ... ON CONFLICT DO UPDATE
+                preference_updates = self._preference_updates(message, intent_analysis, current)
+                if preference_updates:
+                    ChatContext.bulk_set_contexts(conversation, [
+                        ('preferences', key, value, relevance)
+                        for key, value, relevance in preference_updates
+                    ])
+            
+            # Apenas as preferências mudam aqui (e só se algo foi gravado)
+            if preference_updates:
+                self._drop_cached_preferences(conversation, cached)
             
         except Exception as e:
             logger.error(f"Error updating conversation context: {e}")
     
-    def get_conversation_history(self, conversation_id: int, limit: int = 50) -> List[Dict]:
-        """Retorna histórico formatado da conversa"""
+    def _drop_cached_preferences(self, conversation: Conversation, cached: Optional[Dict]):
+        """Remove as preferências do contexto em cache da requisição; demais tipos continuam válidos"""
+        if cached is None:
+            return
+        
+        cache_key = _context_cache_key(conversation.id)
+        context_data = cached.get(cache_key)
+        if context_data and 'preferences' in context_data:
+            cached[cache_key] = {
+                context_type: values for context_type, values in context_data.items()
+                if context_type != 'preferences'
+            }
+    
+    def bulk_update_contexts(self, updates: List[Tuple[Conversation, str, Dict]]):
+        """
+        Versão em lote de _update_conversation_context (ex.: reprocessamento de várias conversas)
+        updates: lista de tuplas (conversa, mensagem, análise de intenção), em ordem cronológica
+        """
         try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            messages = conversation.messages.order_by('created_at')[:limit]
-            
-            history = []
-            for message in messages:
-                history.append({
-                    'id': message.id,
-                    'type': message.message_type,
-                    'content': message.content,
-                    'timestamp': message.created_at.isoformat(),
-                    'intent': message.intent_detected,
-                    'confidence': message.confidence_score,
-                    'user_reaction': message.user_reaction
-                })
+            # Preferências de todas as conversas em uma única query
+            rows = defaultdict(dict)
+            existing_contexts = ChatContext.objects.filter(
+                conversation_id__in={conversation.id for conversation, _, _ in updates},
+                context_type='preferences',
+                context_key__in=PREFERENCE_KEYS
+            )
+            for context in existing_contexts:
+                rows[context.conversation_id][context.context_key] = context
             
-            return history
+            now = request_now()
+            changed, created = {}, []
+            for conversation, message, intent_analysis in updates:
+                current = rows[conversation.id]
+                for key, value, relevance in self._preference_updates(message, intent_analysis, current):
+                    context = current.get(key)
+                    if context is None:
+                        context = ChatContext(conversation=conversation, context_type='preferences', context_key=key)
+                        current[key] = context
+                        created.append(context)
+                    elif context.pk:
+                        changed[context.pk] = context
+                    
+                    context.context_value = value
+                    context.relevance_score = relevance
+                    context.updated_at = now
+            
+            # Duas escritas no total (registros existentes e novos), com um único commit
+            with transaction.atomic():
+                ChatContext.objects.bulk_update(
+                    list(changed.values()), ['context_value', 'relevance_score', 'updated_at']
+                )
+                ChatContext.objects.bulk_create(created, ignore_conflicts=True)
+            
+        except Exception as e:
+            logger.error(f"Error bulk updating conversation contexts: {e}")
+    
+    def rebuild_topics_of_interest(self, conversation: Conversation) -> List[str]:
+        """
+        Recalcula os tópicos de interesse a partir das mensagens (ex.: após importar histórico)
+        em uma única query agregada: as 5 intenções usadas mais recentemente, em ordem cronológica
+        """
+        recent_intents = Message.objects.filter(
+            conversation=conversation,
+            message_type='user',
+            intent_detected__isnull=False
+        ).exclude(intent_detected='').values('intent_detected').annotate(
+            last_used_at=Max('created_at')
+        ).order_by('-last_used_at')[:5]
+        
+        topics = [row['intent_detected'] for row in recent_intents]
+        topics.reverse()
+        ChatContext.bulk_set_contexts(conversation, [
+            ('preferences', 'topics_of_interest', {'topics': topics}, 0.6)
+        ])
+        
+        return topics
+    
+    def _preference_updates(self, message: str, intent_analysis: Dict,
+                            current: Optional[Dict]) -> List[Tuple[str, Dict, float]]:
+        """
+        Novos valores das preferências como tuplas (chave, valor, relevância)
+        current: {context_key: ChatContext} já carregado para a conversa
+        """
+        preference_updates = []
+        
+        # Atualizar preferências conversacionais
+        message_length = len(message.split())
+        if message_length > 20:
+            preference_updates.append((
+                'message_style', {'prefers_detailed': True, 'last_message_length': message_length}, 0.7
+            ))
+        
+        # Atualizar tópicos de interesse
+        intent = intent_analysis.get('intent')
+        if intent:
+            current_topics = current.get('topics_of_interest')
+            
+            if current_topics:
+                previous_topics = current_topics.context_value.get('topics', [])
+                if intent in previous_topics:
+                    # Tópico já registrado: lista inalterada, nada a gravar
+                    return preference_updates
+                # Deque limitado mantém os últimos 5 tópicos sem fatiar a lista
+                topics = deque(previous_topics, maxlen=5)
+                topics.append(intent)
+            else:
+                topics = (intent,)
+            
+            preference_updates.append(('topics_of_interest', {'topics': list(topics)}, 0.6))
+        
+        return preference_updates
+    
+    def get_conversation_history(self, conversation_id: int, limit: int = 50, cached: bool = True) -> List[Dict]:
+        """
+        Retorna histórico formatado da conversa
+        cached: True para leituras repetidas (em cache até a próxima mensagem);
+                False para consultas pontuais, direto do banco sem popular o cache
+        """
+        try:
+            if cached:
+                return self._get_conversation_history_cached(conversation_id, limit)
+            return self._load_conversation_history(conversation_id, limit)
             
-        except Conversation.DoesNotExist:
-            return []
         except Exception as e:
             logger.error(f"Error getting conversation history: {e}")
             return []
     
+    def _get_conversation_history_cached(self, conversation_id: int, limit: int) -> List[Dict]:
+        """Histórico em cache; a versão muda a cada nova mensagem (ver signals)"""
+        cache_key = f"chathist:{conversation_id}:{get_history_version(conversation_id)}:{limit}"
+        return cache.get_or_set(
+            cache_key,
+            lambda: self._load_conversation_history(conversation_id, limit),
+            HISTORY_CACHE_TIMEOUT
+        )
+    
+    def _load_conversation_history(self, conversation_id: int, limit: int) -> List[Dict]:
+        """Histórico formatado direto do banco (uma única query, sem cursor do lado do servidor)"""
+        messages = self._history_values(conversation_id)[:limit]
+        return [self._format_history_message(message) for message in messages]
+    
+    def iter_conversation_history(self, conversation_id: int, limit: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Histórico formatado como gerador, lido do banco em blocos (memória limitada em históricos longos)
+        limit: None percorre a conversa inteira (ex.: exportação)
+        """
+        messages = self._history_values(conversation_id)
+        if limit is not None:
+            messages = messages[:limit]
+        
+        # Blocos de 250 linhas por ida ao banco (cursor do lado do servidor no PostgreSQL)
+        for message in messages.iterator(chunk_size=HISTORY_CHUNK_SIZE):
+            yield self._format_history_message(message)
+    
+    def _history_values(self, conversation_id: int):
+        """Mensagens da conversa em ordem cronológica, sem instanciar modelos (conversa inexistente: vazio)"""
+        return Message.objects.filter(conversation_id=conversation_id).order_by('created_at').values(
+            'id', 'message_type', 'content', 'created_at', 'intent_detected', 'confidence_score', 'user_reaction'
+        )
+    
+    def _format_history_message(self, message: Dict) -> Dict:
+        """Formata uma linha de values() para a resposta do histórico"""
+        return {
+            'id': message['id'],
+            'type': message['message_type'],
+            'content': message['content'],
+            'timestamp': message['created_at'].isoformat(),
+            'intent': message['intent_detected'],
+            'confidence': message['confidence_score'],
+            'user_reaction': message['user_reaction']
+        }
+    
     def end_conversation(self, conversation_id: int, user_rating: float = None) -> Dict:
         """Finaliza conversa com avaliação opcional"""
         try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            conversation.status = 'completed'
+            now = request_now()
+            
+            # PostgreSQL: UPDATE ... RETURNING finaliza e lê as métricas em uma única ida ao banco
+            if connection.vendor == 'postgresql':
+                row = self._end_conversation_returning(conversation_id, user_rating, now)
+                if row is None:
+                    return {'error': 'Conversa não encontrada'}
+                
+                message_count, duration_minutes = row
+                return {
+                    'conversation_ended': True,
+                    'total_messages': message_count,
+                    'duration_minutes': duration_minutes,
+                    'rating_saved': user_rating is not None
+                }
             
+            # Demais bancos: UPDATE apenas das colunas alteradas (timestamps auto_now incluídos manualmente)
+            fields = {'status': 'completed', 'updated_at': now, 'last_activity_at': now}
             if user_rating:
-                conversation.user_satisfaction_rating = user_rating
+                fields['user_satisfaction_rating'] = user_rating
             
-            conversation.save()
+            if not Conversation.objects.filter(id=conversation_id).update(**fields):
+                return {'error': 'Conversa não encontrada'}
+            
+            # Duração calculada no banco; created_at não precisa ser trazido
+            conversation = Conversation.objects.filter(id=conversation_id).annotate(
+                duration=ExpressionWrapper(Now() - F('created_at'), output_field=DurationField())
+            ).values('message_count', 'duration').first()
             
             return {
                 'conversation_ended': True,
-                'total_messages': conversation.message_count,
-                'duration_minutes': (timezone.now() - conversation.created_at).total_seconds() / 60,
+                'total_messages': conversation['message_count'],
+                'duration_minutes': conversation['duration'].total_seconds() / 60,
                 'rating_saved': user_rating is not None
             }
             
-        except Conversation.DoesNotExist:
-            return {'error': 'Conversa não encontrada'}
         except Exception as e:
             logger.error(f"Error ending conversation: {e}")
-            return {'error': 'Erro ao finalizar conversa'}
\ No newline at end of file
+            return {'error': 'Erro ao finalizar conversa'}
+    
+    def _end_conversation_returning(self, conversation_id: int, user_rating: Optional[float],
+                                    now: datetime) -> Optional[Tuple[int, float]]:
+        """
+        UPDATE ... RETURNING (PostgreSQL): mesmas colunas do caminho ORM de end_conversation
+        Retorna (message_count, duração em minutos calculada no banco) ou None se a conversa não existir
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Conversation._meta.db_table} "
+                "SET status = 'completed', "
+                "user_satisfaction_rating = COALESCE(%s, user_satisfaction_rating), "
+                "updated_at = %s, last_activity_at = %s "
+                "WHERE id = %s "
+                f"RETURNING message_count, {DURATION_MINUTES_SQL[connection.vendor]}",
+                [user_rating or None, now, now, conversation_id]
+            )
+            row = cursor.fetchone()
+        
+        if row is None:
+            return None
+        
+        message_count, duration_minutes = row
+        return message_count, float(duration_minutes)
@@ -0,0 +1,39 @@
+# apps/chatbot/signals.py
+import logging
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.users.models import UserProfile
+from apps.workouts.models import WorkoutSession
+from .models import Message
+from .services.chat_service import bump_history_version, init_context_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=WorkoutSession)
+@receiver(post_delete, sender=WorkoutSession)
+def invalidate_init_context(sender, instance, **kwargs):
+    """
+    Perfil ou sessões de treino alterados: descarta o contexto inicial em cache
+    """
+    # Falha no cache nunca deve interromper a gravação no banco
+    try:
+        cache.delete(init_context_cache_key(instance.user_id))
+    except Exception as e:
+        logger.error(f"Error invalidating init context cache for user {instance.user_id}: {e}")
+
+
+@receiver(post_save, sender=Message)
+def invalidate_conversation_history(sender, instance, **kwargs):
+    """
+    Mensagem criada ou alterada (ex.: reação do usuário): históricos em cache da conversa deixam de valer
+    """
+    try:
+        bump_history_version(instance.conversation_id)
+    except Exception as e:
+        logger.error(f"Error invalidating history cache for conversation {instance.conversation_id}: {e}")
@@ -1,10 +1,18 @@
 # apps/chatbot/tests.py
+import json
+from datetime import timedelta
+from unittest import mock
 from django.test import TestCase
+from django.core.cache import cache
+from django.db.models.query import QuerySet
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Conversation, Message
+from django.utils import timezone
+from .models import Conversation, Message, ChatContext
 from .services.chat_service import ChatService
+from apps.users.models import UserProfile
+from apps.workouts.models import Workout, WorkoutSession
 
 class ChatbotIntegrationTest(TestCase):
     def setUp(self):
@@ -48,8 +56,338 @@ class ChatbotIntegrationTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertTrue(response.data['message_sent'])
     
+    def test_export_conversation_history(self):
+        """Exportação do histórico em streaming retorna um array JSON"""
+        conversation = Conversation.objects.create(user=self.user)
+        Message.objects.create(conversation=conversation, message_type='user', content='Olá')
+        
+        response = self.client.get(f'/api/v1/chat/conversations/{conversation.id}/history/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        history = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([message['content'] for message in history], ['Olá'])
+    
     def test_chat_service_initialization(self):
         """Teste de inicialização do serviço"""
         chat_service = ChatService()
         self.assertIsNotNone(chat_service)
-        self.assertIsNotNone(chat_service.ai_service)
\ No newline at end of file
+        self.assertIsNotNone(chat_service.ai_service)
+
+class ChatServiceIntentTest(TestCase):
+    def setUp(self):
+        self.chat_service = ChatService()
+    
+    def test_rule_based_intent_normalizes_message(self):
+        """Mensagens equivalentes geram a mesma análise"""
+        first = self.chat_service._rule_based_intent_analysis('Quero um TREINO   de pernas')
+        second = self.chat_service._rule_based_intent_analysis('  quero um treino de pernas ')
+        self.assertEqual(first, second)
+        self.assertEqual(first['intent'], 'workout_request')
+    
+    def test_rule_based_intent_returns_independent_copies(self):
+        """Resultado memoizado não deve ser alterado por quem o consome"""
+        analysis = self.chat_service._rule_based_intent_analysis('Estou sentindo dor no joelho')
+        keywords = list(analysis['keywords'])
+        analysis['intent'] = 'changed'
+        analysis['keywords'].append('alterado')
+        analysis['secondary_intents'].append('alterado')
+        again = self.chat_service._rule_based_intent_analysis('Estou sentindo dor no joelho')
+        self.assertEqual(again['intent'], 'injury_concern')
+        self.assertEqual(again['urgency_level'], 'high')
+        self.assertEqual(again['keywords'], keywords)
+        self.assertNotIn('alterado', again['secondary_intents'])
+    
+    def test_ai_intent_analysis_normalizes_shape(self):
+        """JSON da IA é validado: chaves extras descartadas, ausentes preenchidas"""
+        payload = '{"intent": "workout_request", "confidence": 0.9, "extra": "ignorar"}'
+        with mock.patch.object(self.chat_service.ai_service, '_make_openai_request', return_value=payload):
+            analysis = self.chat_service._ai_intent_analysis('Quero treinar')
+        
+        self.assertEqual(analysis['intent'], 'workout_request')
+        self.assertEqual(analysis['secondary_intents'], [])
+        self.assertNotIn('extra', analysis)
+    
+    def test_short_message_skips_ai_analysis(self):
+        """Saudações e mensagens curtas usam só as regras, sem consultar a IA"""
+        with mock.patch.object(self.chat_service.ai_service, 'is_available', True), \
+                mock.patch.object(self.chat_service, '_ai_intent_analysis') as ai_analysis:
+            greeting = self.chat_service._analyze_message_intent('  Obrigado ')
+            injury = self.chat_service._analyze_message_intent('lesão!')
+        
+        self.assertEqual(greeting['intent'], 'general_question')
+        self.assertEqual(injury['intent'], 'injury_concern')
+        self.assertEqual(injury['urgency_level'], 'high')
+        ai_analysis.assert_not_called()
+
+
+class ChatServiceContextTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='contextuser', password='testpass123')
+        UserProfile.objects.create(user=self.user, goal='gain_muscle', activity_level='moderate')
+        workout = Workout.objects.create(name='Treino A', description='Corpo inteiro')
+        for _ in range(3):
+            WorkoutSession.objects.create(
+                user=self.user, workout=workout, completed=True,
+                completed_at=timezone.now(), duration_minutes=40
+            )
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.chat_service = ChatService()
+    
+    def test_initialize_conversation_context(self):
+        """Contexto inicial inclui perfil e histórico de treinos"""
+        self.chat_service._initialize_conversation_context(self.conversation)
+        context = self.chat_service._build_conversation_context(self.conversation)
+        
+        self.assertEqual(context['user_profile']['basic_info']['goal'], 'gain_muscle')
+        sessions = context['workout_history']['recent_workouts']['recent_sessions']
+        self.assertEqual(len(sessions), 3)
+        self.assertEqual(sessions[0]['workout_name'], 'Treino A')
+        self.assertEqual(sessions[0]['duration'], 40)
+        self.assertIn('preferences', context)
+    
+    def test_context_filtered_by_intent(self):
+        """Com a intenção informada, só os tipos lidos pelo prompt são carregados"""
+        self.chat_service._initialize_conversation_context(self.conversation)
+        
+        for intent in ('nutrition_advice', 'motivation_need', 'workout_request'):
+            context = self.chat_service._build_conversation_context(self.conversation, intent=intent)
+            self.assertEqual(list(context), ['user_profile', 'workout_history'])
+            
+            prompt = self.chat_service._build_fitness_chat_system_prompt({'intent': intent}, context)
+            self.assertIn('OBJETIVO DO USUÁRIO: gain_muscle', prompt)
+            self.assertIn('NÍVEL ATUAL: moderate', prompt)
+            self.assertIn('HISTÓRICO RECENTE: 3 treinos', prompt)
+    
+    def test_context_omits_types_without_rows(self):
+        """Sem intenção, apenas os tipos com registros são retornados"""
+        self.chat_service._initialize_conversation_context(self.conversation)
+        context = self.chat_service._build_conversation_context(self.conversation)
+        
+        self.assertEqual(set(context), {'user_profile', 'workout_history', 'preferences'})
+    
+    def test_update_context_reads_preferences_once(self):
+        """Tópicos de interesse são atualizados com uma leitura e uma escrita, na mesma transação"""
+        self.chat_service._update_conversation_context(
+            self.conversation, 'Quero treinar', {'intent': 'workout_request'}
+        )
+        # SAVEPOINT + SELECT + upsert + RELEASE (transação aninhada na do TestCase);
+        # mensagem longa grava estilo e tópicos no mesmo upsert
+        long_message = 'E a dieta? ' + 'Quero entender melhor o que comer antes do treino. ' * 3
+        with self.assertNumQueries(4):
+            self.chat_service._update_conversation_context(
+                self.conversation, long_message, {'intent': 'nutrition_advice'}
+            )
+        
+        style = ChatContext.get_context(self.conversation, 'preferences', 'message_style').first()
+        self.assertTrue(style.context_value['prefers_detailed'])
+        
+        topics = ChatContext.get_context(self.conversation, 'preferences', 'topics_of_interest').first()
+        self.assertEqual(topics.context_value['topics'], ['workout_request', 'nutrition_advice'])
+        
+        # Tópico já registrado: apenas a leitura, sem escrita
+        with self.assertNumQueries(3):
+            self.chat_service._update_conversation_context(
+                self.conversation, 'Mais sobre treino', {'intent': 'workout_request'}
+            )
+    
+    def test_bulk_update_contexts(self):
+        """Atualização em lote acumula tópicos por conversa"""
+        other = Conversation.objects.create(user=self.user)
+        self.chat_service._update_conversation_context(
+            self.conversation, 'Quero treinar', {'intent': 'workout_request'}
+        )
+        
+        self.chat_service.bulk_update_contexts([
+            (self.conversation, 'E a dieta?', {'intent': 'nutrition_advice'}),
+            (other, 'Estou sem motivação', {'intent': 'motivation_need'}),
+            (other, 'Como faço agachamento?', {'intent': 'technique_question'}),
+        ])
+        
+        topics = ChatContext.get_context(self.conversation, 'preferences', 'topics_of_interest').first()
+        self.assertEqual(topics.context_value['topics'], ['workout_request', 'nutrition_advice'])
+        topics = ChatContext.get_context(other, 'preferences', 'topics_of_interest').first()
+        self.assertEqual(topics.context_value['topics'], ['motivation_need', 'technique_question'])
+    
+    def test_rebuild_topics_of_interest(self):
+        """Tópicos recalculados a partir das intenções mais recentes das mensagens"""
+        for intent in ['workout_request', 'nutrition_advice', 'workout_request', 'motivation_need']:
+            self.chat_service._save_user_message(self.conversation, 'Mensagem', intent=intent)
+        
+        with self.assertNumQueries(2):
+            topics = self.chat_service.rebuild_topics_of_interest(self.conversation)
+        
+        self.assertEqual(topics, ['nutrition_advice', 'workout_request', 'motivation_need'])
+    
+    def test_async_context_updates_are_batched(self):
+        """Com atualização assíncrona, o turno só enfileira e o worker grava em lote"""
+        self.chat_service.async_context_updates = True
+        submitted = []
+        with mock.patch.object(self.chat_service._executor, 'submit',
+                               side_effect=lambda fn, *args: submitted.append((fn, args))), \
+                mock.patch('apps.chatbot.services.chat_service.connections'):
+            self.chat_service._update_conversation_context(
+                self.conversation, 'Quero treinar', {'intent': 'workout_request'}
+            )
+            self.chat_service._update_conversation_context(
+                self.conversation, 'E a dieta?', {'intent': 'nutrition_advice'}
+            )
+            self.assertFalse(ChatContext.get_context(self.conversation, 'preferences').exists())
+            
+            # Um único worker agendado para os dois turnos
+            self.assertEqual(len(submitted), 1)
+            fn, args = submitted[0]
+            fn(*args)
+        
+        topics = ChatContext.get_context(self.conversation, 'preferences', 'topics_of_interest').first()
+        self.assertEqual(topics.context_value['topics'], ['workout_request', 'nutrition_advice'])
+    
+    def test_profile_change_invalidates_cached_context(self):
+        """Alterar o perfil descarta o contexto inicial em cache"""
+        self.chat_service._initialize_conversation_context(self.conversation)
+        
+        profile = UserProfile.objects.get(user=self.user)
+        profile.goal = 'lose_weight'
+        profile.save()
+        
+        conversation = Conversation.objects.create(user=self.user)
+        self.chat_service._initialize_conversation_context(conversation)
+        context = self.chat_service._build_conversation_context(conversation)
+        
+        self.assertEqual(context['user_profile']['basic_info']['goal'], 'lose_weight')
+
+
+class ChatServiceRequestCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cacheuser', password='testpass123')
+        self.conversation = Conversation.objects.create(user=self.user)
+        self.chat_service = ChatService()
+        self.chat_service.ai_service.is_available = True
+    
+    def test_history_is_reused_between_turns(self):
+        """Segundo turno monta o prompt a partir do histórico em cache"""
+        with mock.patch.object(self.chat_service.ai_service, '_make_openai_request',
+                               return_value='Faça 3 séries de agachamento.') as request:
+            self.chat_service.process_user_message(self.conversation.id, 'Quero um treino de pernas')
+            with mock.patch.object(self.conversation.__class__, 'get_last_messages') as get_last:
+                result = self.chat_service.process_user_message(self.conversation.id, 'Quantas séries?')
+                get_last.assert_not_called()
+        
+        self.assertEqual(result['method'], 'ai_powered')
+        prompt_messages = request.call_args[0][0]
+        self.assertEqual(
+            [m['role'] for m in prompt_messages[1:]],
+            ['user', 'assistant', 'user', 'user']
+        )
+        self.assertEqual(prompt_messages[-1]['content'], 'Quantas séries?')
+    
+    def test_cache_read_failure_does_not_break_turn(self):
+        """Falha no get_many do cache não impede o processamento da mensagem"""
+        with mock.patch.object(self.chat_service.ai_service, '_make_openai_request',
+                               return_value='Faça 3 séries de agachamento.'), \
+                mock.patch.object(cache, 'get_many', side_effect=ConnectionError('cache offline')):
+            result = self.chat_service.process_user_message(self.conversation.id, 'Quero um treino de pernas')
+        
+        self.assertEqual(result['method'], 'ai_powered')
+    
+    def test_conversation_history_single_query(self):
+        """Histórico formatado é montado com uma única query"""
+        with mock.patch.object(self.chat_service.ai_service, '_make_openai_request',
+                               return_value='Faça 3 séries de agachamento.'):
+            self.chat_service.process_user_message(self.conversation.id, 'Quero um treino de pernas')
+        
+        # Caminho curto não abre cursor do lado do servidor (iterator() custa 4 idas no PostgreSQL)
+        with self.assertNumQueries(1), mock.patch.object(QuerySet, 'iterator') as iterator:
+            history = self.chat_service.get_conversation_history(self.conversation.id)
+        
+        iterator.assert_not_called()
+        self.assertEqual([item['type'] for item in history], ['user', 'ai'])
+        self.assertEqual(self.chat_service.get_conversation_history(0), [])
+    
+    def test_conversation_history_cached_until_new_message(self):
+        """Histórico vem do cache até que uma nova mensagem seja gravada"""
+        self.chat_service._save_user_message(self.conversation, 'Oi')
+        self.chat_service.get_conversation_history(self.conversation.id)
+        
+        with self.assertNumQueries(0):
+            history = self.chat_service.get_conversation_history(self.conversation.id)
+        self.assertEqual(len(history), 1)
+        
+        self.chat_service._save_user_message(self.conversation, 'Quero um treino')
+        self.assertEqual(len(self.chat_service.get_conversation_history(self.conversation.id)), 2)
+    
+    def test_conversation_history_cache_dropped_on_feedback(self):
+        """Reação do usuário em uma mensagem invalida o histórico em cache"""
+        message = self.chat_service._save_user_message(self.conversation, 'Oi')
+        self.chat_service.get_conversation_history(self.conversation.id)
+        
+        message.add_user_feedback('helpful')
+        history = self.chat_service.get_conversation_history(self.conversation.id)
+        self.assertEqual(history[0]['user_reaction'], 'helpful')
+    
+    def test_cache_failure_does_not_break_message_save(self):
+        """Erro do cache na invalidação via signal não impede a gravação da mensagem"""
+        with mock.patch.object(cache, 'set', side_effect=ConnectionError('cache offline')):
+            self.chat_service._save_user_message(self.conversation, 'Oi')
+        
+        self.assertEqual(self.conversation.messages.count(), 1)
+    
+    def test_live_conversation_history_skips_cache(self):
+        """Consulta pontual vai direto ao banco sem ler nem popular o cache"""
+        self.chat_service._save_user_message(self.conversation, 'Oi')
+        
+        with mock.patch('apps.chatbot.services.chat_service.cache') as history_cache:
+            history = self.chat_service.get_conversation_history(self.conversation.id, cached=False)
+        
+        self.assertEqual(len(history), 1)
+        history_cache.get.assert_not_called()
+        history_cache.get_or_set.assert_not_called()
+    
+    def test_end_conversation(self):
+        """Finalizar conversa grava status e avaliação"""
+        result = self.chat_service.end_conversation(self.conversation.id, user_rating=4.0)
+        
+        self.assertTrue(result['conversation_ended'])
+        self.assertGreaterEqual(result['duration_minutes'], 0)
+        self.assertLess(result['duration_minutes'], 1)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.status, 'completed')
+        self.assertEqual(self.conversation.user_satisfaction_rating, 4.0)
+        self.assertEqual(self.chat_service.end_conversation(0), {'error': 'Conversa não encontrada'})
+    
+    def test_end_conversation_returning(self):
+        """UPDATE ... RETURNING grava status, mantém avaliação anterior sem nova nota e calcula a duração no banco"""
+        now = timezone.now()
+        Conversation.objects.filter(id=self.conversation.id).update(created_at=now - timedelta(minutes=30))
+        
+        message_count, duration_minutes = self.chat_service._end_conversation_returning(
+            self.conversation.id, 4.0, now
+        )
+        self.assertEqual(message_count, self.conversation.message_count)
+        self.assertAlmostEqual(duration_minutes, 30, delta=1)
+        
+        self.chat_service._end_conversation_returning(self.conversation.id, None, now)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.status, 'completed')
+        self.assertEqual(self.conversation.user_satisfaction_rating, 4.0)
+        self.assertEqual(self.conversation.last_activity_at, now)
+        
+        self.assertIsNone(self.chat_service._end_conversation_returning(0, 5.0, now))
+    
+    def test_process_message_unknown_conversation(self):
+        """Mensagem para conversa inexistente retorna erro sem gravar nada nem analisar intenção"""
+        with mock.patch.object(self.chat_service, '_analyze_message_intent') as analyze:
+            result = self.chat_service.process_user_message(0, 'Quero um treino de pernas')
+        
+        self.assertEqual(result['error'], 'Conversa não encontrada')
+        self.assertFalse(Message.objects.exists())
+        analyze.assert_not_called()
+    
+    def test_user_message_saved_with_intent(self):
+        """Mensagem do usuário é gravada já com a intenção detectada"""
+        self.chat_service.ai_service.is_available = False
+        self.chat_service.process_user_message(self.conversation.id, 'Preciso de uma dieta com mais proteína')
+        
+        user_message = self.conversation.messages.get(message_type='user')
+        self.assertEqual(user_message.intent_detected, 'nutrition_advice')
@@ -12,6 +12,7 @@ urlpatterns = [
     path('conversations/start/', views.start_conversation, name='start_conversation'),
     path('conversations/<int:conversation_id>/message/', views.send_message, name='send_message'),
     path('conversations/<int:conversation_id>/history/', views.get_conversation_history, name='conversation_history'),
+    path('conversations/<int:conversation_id>/history/export/', views.export_conversation_history, name='export_conversation_history'),
     path('conversations/<int:conversation_id>/end/', views.end_conversation, name='end_conversation'),
     path('conversations/', views.get_user_conversations, name='user_conversations'),
     
@@ -31,6 +32,7 @@ urlpatterns = [
 # /api/v1/chat/conversations/start/                     - Iniciar nova conversa
 # /api/v1/chat/conversations/{id}/message/              - Enviar mensagem
 # /api/v1/chat/conversations/{id}/history/              - Histórico da conversa
+# /api/v1/chat/conversations/{id}/history/export/       - Exportar histórico completo (streaming)
 # /api/v1/chat/conversations/{id}/end/                  - Finalizar conversa
 # /api/v1/chat/conversations/                           - Listar conversas do usuário
 #
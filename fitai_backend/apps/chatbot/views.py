@@ -7,13 +7,14 @@ from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from datetime import datetime, timedelta
 from functools import wraps
 from typing import Dict, List  # Adicionado esta linha
 from rest_framework.permissions import IsAuthenticated, AllowAny  # ← Adicione AllowAny aqui
 
 from .models import Conversation, Message, ChatContext, ChatMetrics
-from .services.chat_service import ChatService
+from .services.chat_service import ChatService, bump_history_version, get_history_version
 from apps.users.models import UserProfile
 from apps.recommendations.services.ai_service import AIService
 
@@ -468,8 +469,8 @@ def get_conversation_history(request, conversation_id):
                 'conversation_id': conversation_id
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Cache key para histórico
-        cache_key = f"conversation_history_{conversation_id}_{offset}_{limit}"
+        # Cache key para histórico (a versão muda a cada nova mensagem, invalidando todas as páginas)
+        cache_key = f"conversation_history_{conversation_id}_{get_history_version(conversation_id)}_{offset}_{limit}"
         cached_history = cache.get(cache_key)
         
         if cached_history and not include_context:
@@ -567,6 +568,29 @@ def get_conversation_history(request, conversation_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@rate_limit_chatbot(max_requests_per_hour=10)
+def export_conversation_history(request, conversation_id):
+    """
+    Exporta o histórico completo de uma conversa como JSON em streaming
+    (mensagens lidas do banco em blocos; memória independe do tamanho do histórico)
+    """
+    if not Conversation.objects.filter(id=conversation_id, user=request.user).exists():
+        return Response({
+            'error': 'Conversa não encontrada',
+            'conversation_id': conversation_id
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    def stream_messages():
+        yield '['
+        for index, message in enumerate(ChatService().iter_conversation_history(conversation_id)):
+            yield (',' if index else '') + json.dumps(message, ensure_ascii=False)
+        yield ']'
+    
+    return StreamingHttpResponse(stream_messages(), content_type='application/json')
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 @rate_limit_chatbot(max_requests_per_hour=20)
@@ -756,11 +780,17 @@ def end_conversation(request, conversation_id):
         
         # Salvar feedback adicional se fornecido
         if feedback and len(feedback) <= 500:
-            # Encontrar última mensagem da IA para adicionar feedback
-            last_ai_message = conversation.messages.filter(message_type='ai').order_by('-created_at').first()
-            if last_ai_message:
-                last_ai_message.user_feedback = feedback
-                last_ai_message.save()
+            # Encontrar última mensagem da IA e gravar só o feedback (UPDATE de uma coluna)
+            last_ai_message_id = conversation.messages.filter(
+                message_type='ai'
+            ).order_by('-created_at').values_list('id', flat=True).first()
+            if last_ai_message_id:
+                Message.objects.filter(pk=last_ai_message_id).update(user_feedback=feedback)
+                # update() não dispara post_save: invalidar o histórico em cache aqui
+                try:
+                    bump_history_version(conversation_id)
+                except Exception as e:
+                    logger.warning(f"Failed to invalidate history cache after feedback: {e}")
         
         # Atualizar métricas
         try:
@@ -0,0 +1,32 @@
+# apps/core/middleware.py
+from contextvars import ContextVar
+
+from django.utils import timezone
+
+# Horário de entrada da requisição atual (None fora de requisições)
+_request_now = ContextVar('request_now', default=None)
+
+
+def request_now():
+    """
+    Horário da requisição atual, obtido uma única vez por requisição.
+    Fora de uma requisição (shell, tarefas, threads auxiliares) equivale a timezone.now().
+    """
+    now = _request_now.get()
+    return now if now is not None else timezone.now()
+
+
+class RequestNowMiddleware:
+    """
+    Registra timezone.now() na entrada da requisição para reutilização via request_now()
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        token = _request_now.set(timezone.now())
+        try:
+            return self.get_response(request)
+        finally:
+            _request_now.reset(token)
@@ -1,3 +1,19 @@
-from django.test import TestCase
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
 
-# Create your tests here.
+from .middleware import RequestNowMiddleware, _request_now, request_now
+
+
+class RequestNowMiddlewareTest(TestCase):
+    def test_request_now_is_fixed_per_request(self):
+        """Dentro da requisição request_now() retorna sempre o mesmo horário"""
+        seen = []
+        
+        def view(request):
+            seen.extend([request_now(), request_now()])
+            return HttpResponse()
+        
+        RequestNowMiddleware(view)(RequestFactory().get('/'))
+        
+        self.assertEqual(seen[0], seen[1])
+        self.assertIsNone(_request_now.get())
@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.core.middleware.RequestNowMiddleware',
 ]
 
 ROOT_URLCONF = 'fitai.urls'
@@ -331,6 +332,10 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TIMEZONE = 'America/Sao_Paulo'
 CELERY_ENABLE_UTC = True
 
+# Enquanto o Celery não está ativo: atualizações de contexto do chat gravadas em lote
+# por um worker em processo, fora do caminho da resposta
+CHATBOT_ASYNC_CONTEXT_UPDATES = config('CHATBOT_ASYNC_CONTEXT_UPDATES', default=False, cast=bool)
+
 # Tarefas específicas de IA
 CELERY_ROUTES = {
     'apps.recommendations.tasks.generate_ai_recommendations': {'queue': 'ai_tasks'},